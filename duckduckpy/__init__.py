@@ -9,6 +9,24 @@ __license__ = 'MIT'
 __url__ = 'https://github.com/ivankliuk/duckduckpy/'
 __all__ = ['query', 'secure_query']
 
+import sys
 
-from duckduckpy.core import query
-from duckduckpy.core import secure_query
+
+def __getattr__(name):
+    """Imports query functions from core module on first access.
+
+    Keeps 'import duckduckpy' cheap, since core pulls in HTTP client, JSON
+    and socket modules.
+    """
+    if name in __all__:
+        from duckduckpy import core
+        value = globals()[name] = getattr(core, name)
+        return value
+    raise AttributeError(
+        "module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+# Module level __getattr__ is supported since Python 3.7 only.
+if sys.version_info < (3, 7):
+    from duckduckpy.core import query
+    from duckduckpy.core import secure_query
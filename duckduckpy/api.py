@@ -24,7 +24,6 @@
 from __future__ import unicode_literals
 
 from . import __version__
-from .utils import camel_to_snake_case_set
 
 from collections import namedtuple
 
@@ -39,8 +38,48 @@ RESPONSE_KEYS = set([
     'ImageHeight', 'Heading', 'Answer', 'AbstractText', 'Type', 'ImageIsLogo',
     'DefinitionSource', 'AbstractURL', 'Abstract', 'DefinitionURL', 'Results',
     'Entity', 'AnswerType', 'AbstractSource', 'Image', 'meta'])
-Icon = namedtuple('Icon', camel_to_snake_case_set(ICON_KEYS))
-Result = namedtuple('Result', camel_to_snake_case_set(RESULT_KEYS))
-RelatedTopic = namedtuple('RelatedTopic',
-                          camel_to_snake_case_set(RELATED_TOPIC_KEYS))
-Response = namedtuple('Response', camel_to_snake_case_set(RESPONSE_KEYS))
+
+# Snake case names of the keys above, i.e. the result of
+# utils.camel_to_snake_case. Kept precomputed to not run regular
+# expressions neither at import time nor for every deserialized object.
+SNAKE_CASE_KEYS = {
+    'Abstract': 'abstract',
+    'AbstractSource': 'abstract_source',
+    'AbstractText': 'abstract_text',
+    'AbstractURL': 'abstract_url',
+    'Answer': 'answer',
+    'AnswerType': 'answer_type',
+    'Definition': 'definition',
+    'DefinitionSource': 'definition_source',
+    'DefinitionURL': 'definition_url',
+    'Entity': 'entity',
+    'FirstURL': 'first_url',
+    'Heading': 'heading',
+    'Height': 'height',
+    'Icon': 'icon',
+    'Image': 'image',
+    'ImageHeight': 'image_height',
+    'ImageIsLogo': 'image_is_logo',
+    'ImageWidth': 'image_width',
+    'Infobox': 'infobox',
+    'Name': 'name',
+    'Redirect': 'redirect',
+    'RelatedTopics': 'related_topics',
+    'Result': 'result',
+    'Results': 'results',
+    'Text': 'text',
+    'Topics': 'topics',
+    'Type': 'type',
+    'URL': 'url',
+    'Width': 'width',
+    'meta': 'meta'}
+
+Icon = namedtuple('Icon', ['url', 'width', 'height'])
+Result = namedtuple('Result', ['first_url', 'icon', 'result', 'text'])
+RelatedTopic = namedtuple('RelatedTopic', ['name', 'topics'])
+Response = namedtuple('Response', [
+    'abstract', 'abstract_source', 'abstract_text', 'abstract_url', 'answer',
+    'answer_type', 'definition', 'definition_source', 'definition_url',
+    'entity', 'heading', 'image', 'image_height', 'image_is_logo',
+    'image_width', 'infobox', 'meta', 'redirect', 'related_topics',
+    'results', 'type'])
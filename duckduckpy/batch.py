@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+from . import core
+from .cache import cache_key
+
+from collections import namedtuple
+from collections import OrderedDict
+import copy as copy_module
+
+
+class BatchResult(namedtuple('BatchResult',
+                             ['results', 'total', 'unique', 'errors'])):
+    """Result of batch_query.
+
+    results: Responses in the order of the passed terms. None at the
+        positions of failed terms.
+    total: Number of the passed terms.
+    unique: Number of the requests actually sent.
+    errors: A dict of positions of failed terms to raised exceptions.
+    """
+    __slots__ = ()
+
+    @property
+    def saved(self):
+        """Number of requests saved by deduplication."""
+        return self.total - self.unique
+
+
+def normalize_term(term):
+    """Collapses whitespace in 'term' and converts it to lower case."""
+    return ' '.join(term.split()).lower()
+
+
+def batch_query(terms, normalize=normalize_term, copy=False, query=None,
+                **kwargs):
+    """Sends a batch of queries, each unique one only once.
+
+    Terms are normalized and deduplicated together with their options, so
+    that every unique (term, options) pair is fetched once, and the
+    response is mapped back to every position it was requested at. The
+    first occurrence of a term is what is sent. A failed request doesn't
+    stop the batch: its exception is reported at every position of the
+    term, and the other responses are still returned.
+
+    Args:
+        terms: An iterable of query strings or (query string, options)
+            pairs, where options is a dict of core.query arguments
+            overriding the ones passed in 'kwargs'.
+        normalize: A callable which maps a term to its canonical form or
+            None to deduplicate exact matches only.
+            Default value: normalize_term.
+        copy: Give every position its own copy of the response when the
+            'dict' container is used. Namedtuple responses are always
+            shared. Default value: False.
+        query: A callable sending the requests, e.g. ResponseCache.query or
+            PriorityScheduler.query. Default value: core.query.
+        kwargs: Arguments of core.query common for all the terms.
+
+    Returns:
+        BatchResult instance.
+
+    Usage:
+        >>> batch = batch_query(['Python', ' python', ('Python', {
+        ...     'no_html': True})], container='dict')
+        >>> batch.total, batch.unique, batch.saved
+        (3, 2, 1)
+        >>> batch.results[0] is batch.results[1]
+        True
+    """
+    requests = OrderedDict()
+    positions = []
+    for term in terms:
+        options = kwargs
+        if not isinstance(term, (type(''), bytes)):
+            term, term_options = term
+            options = dict(kwargs)
+            options.update(term_options)
+        key = cache_key(normalize(term) if normalize else term, **options)
+        requests.setdefault(key, (term, options))
+        positions.append(key)
+
+    query = query or core.query
+    responses = {}
+    failures = {}
+    for key, (term, options) in requests.items():
+        try:
+            responses[key] = query(term, **options)
+        except Exception as e:
+            failures[key] = e
+
+    results = []
+    errors = {}
+    seen = set()
+    for position, key in enumerate(positions):
+        if key in failures:
+            errors[position] = failures[key]
+            results.append(None)
+            continue
+        response = responses[key]
+        if key in seen and copy and requests[key][1].get(
+                'container') == 'dict':
+            response = copy_module.deepcopy(response)
+        seen.add(key)
+        results.append(response)
+    return BatchResult(results, len(positions), len(requests), errors)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+from . import core
+from . import exception as exc
+from . import instrumentation
+from .cache import cache_key
+
+from collections import deque
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+_missing = object()
+
+
+class CircuitBreaker(object):
+    """Circuit breaker and load shedder for calls to DuckDuckGo API.
+
+    While the breaker is closed, outcomes of the last 'window' calls are
+    tracked. Failed calls and calls slower than 'latency' seconds count as
+    errors. Once the error rate reaches 'error_rate' the breaker opens and
+    rejects calls right away. After 'reset_timeout' seconds it becomes
+    half-open and lets 'half_open_calls' probe calls through: a successful
+    probe closes the breaker, a failed one opens it again.
+
+    Independently of the state, no more than 'max_in_flight' calls are
+    allowed at a time. Excess calls are shed immediately.
+
+    A slow call is only counted once it returns, so 'latency' can not trip
+    the breaker on hung connections unless the calls are bounded by a socket
+    'timeout'. Queries sent with 'query' get it passed down to core.query.
+
+    Args:
+        error_rate: Error rate which opens the breaker. Default value: 0.5.
+        latency: Number of seconds after which a call counts as an error.
+            Default value: 10.
+        window: Number of the last calls the error rate is computed over.
+            Default value: 20.
+        min_calls: Minimal number of calls in the window before the breaker
+            can open. Default value: 10.
+        reset_timeout: Number of seconds the breaker stays open.
+            Default value: 30.
+        half_open_calls: Number of concurrent probe calls in half-open state.
+            Default value: 1.
+        max_in_flight: Maximum number of concurrent calls. Default value: 32.
+        timeout: Number of seconds socket operations of queries may block or
+            None to block indefinitely. Default value: None.
+        name: Name under which the breaker statistics are registered in
+            instrumentation or None to not register them. Names must be
+            unique, a breaker registered under the same name is replaced.
+            Default value: None.
+        clock: A callable returning the current time in seconds.
+
+    Usage:
+        >>> breaker = CircuitBreaker(error_rate=0.3, max_in_flight=16,
+        ...                          name='circuit_breaker')
+        >>> cache = ResponseCache()
+        >>> response = breaker.query('Python', cache=cache)
+        >>> instrumentation.snapshot()['circuit_breaker']['state']
+        u'closed'
+    """
+
+    def __init__(self, error_rate=0.5, latency=10, window=20, min_calls=10,
+                 reset_timeout=30, half_open_calls=1, max_in_flight=32,
+                 timeout=None, name=None, clock=time.time):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._clock = clock
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = None
+        self._in_flight = 0
+        self._probes = 0
+        self._counters = dict.fromkeys(
+            ['calls', 'failures', 'slow', 'rejected', 'shed'], 0)
+        self._lock = threading.Lock()
+        if name is not None:
+            instrumentation.register(name, self.stats)
+
+    def _current_state(self):
+        if (self._state == OPEN and
+                self._clock() >= self._opened_at + self.reset_timeout):
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    @property
+    def state(self):
+        """One of 'closed', 'open' and 'half-open'."""
+        with self._lock:
+            return self._current_state()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+
+    def _acquire(self):
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and
+                                 self._probes >= self.half_open_calls):
+                self._counters['rejected'] += 1
+                raise exc.DuckDuckCircuitOpenError(
+                    "Circuit breaker is open, request is not sent")
+            if self._in_flight >= self.max_in_flight:
+                self._counters['shed'] += 1
+                raise exc.DuckDuckOverloadError(
+                    "Too many requests in flight: {0}".format(
+                        self._in_flight))
+            self._in_flight += 1
+            if state == HALF_OPEN:
+                self._probes += 1
+            return state
+
+    def _release(self, state, failed):
+        with self._lock:
+            self._in_flight -= 1
+            self._counters['calls'] += 1
+            if failed:
+                self._counters['failures'] += 1
+            if state == HALF_OPEN:
+                self._probes -= 1
+                if self._state != HALF_OPEN:
+                    return
+                if failed:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            if self._state != CLOSED:
+                return
+            self._outcomes.append(failed)
+            if (len(self._outcomes) >= self.min_calls and
+                    sum(self._outcomes) >=
+                    self.error_rate * len(self._outcomes)):
+                self._open()
+
+    def call(self, func, *args, **kwargs):
+        """Calls 'func' with the given arguments through the breaker.
+
+        Raises:
+            DuckDuckCircuitOpenError: The breaker is open.
+            DuckDuckOverloadError: Too many calls are in flight.
+        """
+        state = self._acquire()
+        started = self._clock()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = self._clock() - started > self.latency
+            if failed:
+                with self._lock:
+                    self._counters['slow'] += 1
+            return result
+        except exc.DuckDuckArgumentError:
+            # Caller's mistake tells nothing about the upstream health.
+            failed = False
+            raise
+        finally:
+            self._release(state, failed)
+
+    def query(self, query_string, cache=None, **kwargs):
+        """Same as core.query, but sent through the breaker.
+
+        Unless 'timeout' is passed, the one of the breaker is used.
+        If 'cache' is passed, fresh entries are served from it, responses
+        are stored in it and, while the breaker is open or sheds load, stale
+        entries are served instead of raising DuckDuckCircuitOpenError or
+        DuckDuckOverloadError.
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        key = cache_key(query_string, **kwargs)
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        if cache is None:
+            return self.call(core.query, query_string, **kwargs)
+
+        value = cache.get(key, _missing)
+        if value is not _missing:
+            return value
+        try:
+            value = self.call(core.query, query_string, **kwargs)
+        except (exc.DuckDuckCircuitOpenError, exc.DuckDuckOverloadError):
+            value = cache.get(key, _missing, stale=True)
+            if value is _missing:
+                raise
+            return value
+        cache.set(key, value)
+        return value
+
+    def stats(self):
+        """Returns a dict with the breaker state and counters."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(
+                state=self._current_state(),
+                in_flight=self._in_flight,
+                error_rate=(float(sum(self._outcomes)) /
+                            len(self._outcomes) if self._outcomes else 0.0))
+            return stats
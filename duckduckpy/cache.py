@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+from . import core
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+_missing = object()
+
+
+def cache_key(query_string, **kwargs):
+    """Builds a hashable cache key out of query string and query options."""
+    return (query_string, tuple(sorted(kwargs.items())))
+
+
+class ResponseCache(object):
+    """Thread-safe in-memory cache of query results with per-entry TTL.
+
+    Args:
+        ttl: Number of seconds an entry is considered fresh.
+            Default value: 300.
+        maxsize: Maximum number of entries. The least recently used entries
+            are evicted first. Default value: None (unlimited).
+        clock: A callable returning the current time in seconds.
+        fallback: An object with 'entry', 'expires_at' and 'keys' methods,
+            e.g. snapshot.Snapshot, which is consulted for the keys missing
+            in the cache. Its entries are treated as cache entries, but are
+            loaded into memory on the first 'get' only. Default value: None.
+    """
+
+    def __init__(self, ttl=300, maxsize=None, clock=time.time, fallback=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.fallback = fallback
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Returns number of the entries held in memory."""
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default=None, stale=False):
+        """Returns cached value for 'key'.
+
+        Expired entries are returned only when 'stale' is True.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+        if entry is None and self.fallback is not None:
+            entry = self.fallback.entry(key)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if not stale and expires_at <= self._clock():
+            return default
+        return value
+
+    def _store(self, key, entry):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        if self.maxsize is not None:
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """Stores 'value' under 'key' for 'ttl' seconds.
+
+        Absolute expiration time can be passed as 'expires_at' instead.
+        """
+        if expires_at is None:
+            if ttl is None:
+                ttl = self.ttl
+            expires_at = self._clock() + ttl
+        with self._lock:
+            self._store(key, (value, expires_at))
+        for listener in self._listeners:
+            try:
+                listener(key, value)
+            except Exception:
+                log.exception("Cache listener %r failed", listener)
+
+    def subscribe(self, listener):
+        """Registers 'listener' to be called with (key, value) on every set.
+
+        Errors raised by listeners are logged and don't fail the set.
+        E.g. ResultIndex.add can be subscribed to keep an index up to date.
+        """
+        self._listeners.append(listener)
+
+    def expires_at(self, key):
+        """Returns expiration time of 'key' or None if it isn't cached."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry[1]
+        if self.fallback is not None:
+            return self.fallback.expires_at(key)
+        return None
+
+    def _fallback_keys(self, keys):
+        if self.fallback is None:
+            return []
+        keys = set(keys)
+        return [key for key in self.fallback.keys() if key not in keys]
+
+    def entries(self, include_fallback=True):
+        """Returns a list of (key, value, expires_at) for all the entries.
+
+        Entries of the fallback which aren't loaded yet are deserialized,
+        unless 'include_fallback' is False.
+        """
+        with self._lock:
+            entries = [(key, value, expires_at) for key, (value, expires_at)
+                       in self._entries.items()]
+        if include_fallback:
+            for key in self._fallback_keys(entry[0] for entry in entries):
+                value, expires_at = self.fallback.entry(key)
+                entries.append((key, value, expires_at))
+        return entries
+
+    def keys(self):
+        """Returns a list of all cached keys, including expired ones."""
+        with self._lock:
+            keys = list(self._entries)
+        return keys + self._fallback_keys(keys)
+
+    def query(self, query_string, **kwargs):
+        """Same as core.query, but serves fresh entries from the cache."""
+        key = cache_key(query_string, **kwargs)
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = core.query(query_string, **kwargs)
+            self.set(key, value)
+        return value
@@ -28,6 +28,8 @@ from . import exception as exc
 from .utils import camel_to_snake_case
 from .utils import is_python2
 from .utils import decoder
+from .utils import quote_plus
+from .utils import BufferPool
 
 import functools
 import json
@@ -41,6 +43,9 @@ else:
     import http.client as http_client
     from urllib.parse import urlencode
 
+# Response bodies are read into pooled buffers to cut allocation churn.
+_buffer_pool = BufferPool()
+
 
 class Hook(object):
     """A hook for dict-objects serialization."""
@@ -63,7 +68,10 @@ class Hook(object):
         keys = set(self.dict_object.keys())
         for key in keys:
             val = self.dict_object.pop(key)
-            self.dict_object[camel_to_snake_case(key)] = val
+            snake_case_key = api.SNAKE_CASE_KEYS.get(key)
+            if snake_case_key is None:
+                snake_case_key = camel_to_snake_case(key)
+            self.dict_object[snake_case_key] = val
 
     def serialize(self, class_name):
         self._camel_to_snake_case()
@@ -122,9 +130,61 @@ def url_assembler(query_string, no_redirect=0, no_html=0, skip_disambig=0, lang=
     return '/?' + urlencode(params)
 
 
+def _content_length(resp):
+    getheader = getattr(resp, 'getheader', None)
+    if getheader is None:
+        return None
+    value = getheader('Content-Length')
+    if not isinstance(value, (bytes, type(''))) or not value.isdigit():
+        return None
+    return int(value)
+
+
+def read_response(resp, pool=_buffer_pool):
+    """Reads and decodes the body of HTTP response.
+
+    If the response carries 'Content-Length' header, the body is read with
+    'readinto' into a pooled buffer and decoded straight from it, so that
+    no intermediate 'bytes' object is created. Otherwise falls back to
+    'resp.read()'.
+
+    Args:
+        resp: HTTP response or any other file-like object.
+        pool: BufferPool instance or None to disable pooling.
+
+    Returns:
+        Decoded response body.
+
+    Raises:
+        DuckDuckConnectionError: The connection was closed before the whole
+            body announced by 'Content-Length' was received.
+    """
+    length = _content_length(resp)
+    if (pool is None or length is None or length > pool.max_size or
+            not hasattr(resp, 'readinto')):
+        return decoder(resp.read())
+
+    buf = pool.acquire(length)
+    try:
+        view = memoryview(buf)
+        received = 0
+        while received < length:
+            size = resp.readinto(view[received:length])
+            if not size:
+                break
+            received += size
+        if received < length:
+            raise exc.DuckDuckConnectionError(
+                "Response body is truncated: received %d of %d bytes" %
+                (received, length))
+        return decoder(view[:received])
+    finally:
+        pool.release(buf)
+
+
 def query(query_string, secure=False, container='namedtuple', verbose=False,
           user_agent=api.USER_AGENT, no_redirect=False, no_html=False,
-          skip_disambig=False, lang=None):
+          skip_disambig=False, lang=None, timeout=None):
     """
     Generates and sends a query to DuckDuckGo API.
 
@@ -150,6 +210,8 @@ def query(query_string, secure=False, container='namedtuple', verbose=False,
 
         lang: Override "us-en" language & region. Default value: None
             See https://duckduckgo.com/params
+        timeout: Number of seconds socket operations may block or None to
+            block indefinitely. Default value: None.
 
     Raises:
         DuckDuckDeserializeError: JSON serialization failed.
@@ -184,41 +246,93 @@ def query(query_string, secure=False, container='namedtuple', verbose=False,
         >>> response['related_topics'][0]
         {u'first_url': u'https://duckduckgo.com/Python', u'text': ...}
     """
-    if container not in Hook.containers:
-        raise exc.DuckDuckArgumentError(
-            "Argument 'container' must be one of the values: "
-            "{0}".format(', '.join(Hook.containers)))
-
-    headers = {"User-Agent": user_agent}
-    url = url_assembler(
-        query_string,
+    prepared = PreparedQuery(
+        secure=secure,
+        container=container,
+        verbose=verbose,
+        user_agent=user_agent,
         no_redirect=no_redirect,
         no_html=no_html,
         skip_disambig=skip_disambig,
-        lang=lang)
+        lang=lang,
+        timeout=timeout)
+    return prepared(query_string)
 
-    if secure:
-        conn = http_client.HTTPSConnection(api.SERVER_HOST)
-    else:
-        conn = http_client.HTTPConnection(api.SERVER_HOST)
 
-    try:
-        conn.request("GET", url, "", headers)
-        resp = conn.getresponse()
-        data = decoder(resp.read())
-    except socket.gaierror as e:
-        raise exc.DuckDuckConnectionError(e.strerror)
-    finally:
-        conn.close()
+class PreparedQuery(object):
+    """A query to DuckDuckGo API with all the options fixed in advance.
 
-    hook = Hook(container, verbose=verbose)
-    try:
-        obj = json.loads(data, object_hook=hook)
-    except ValueError:
-        raise exc.DuckDuckDeserializeError(
-            "Unable to deserialize response to an object")
+    The request options, headers, connection class and container are
+    validated and assembled once, so that only the query string is encoded
+    on every call. Useful for hot paths which send many queries with the
+    same options.
+
+    Args:
+        The same as for query function, except 'query_string'.
+
+    Raises:
+        DuckDuckArgumentError: Passed argument is wrong.
+
+    Usage:
+        >>> from duckduckpy.core import PreparedQuery
+        >>> prepared = PreparedQuery(no_html=True, container='dict')
+        >>> response = prepared('Python')
+        >>> prepared.url('Python')
+        u'/?q=Python&format=json&no_html=1'
+    """
 
-    return obj
+    def __init__(self, secure=False, container='namedtuple', verbose=False,
+                 user_agent=api.USER_AGENT, no_redirect=False, no_html=False,
+                 skip_disambig=False, lang=None, timeout=None):
+        if container not in Hook.containers:
+            raise exc.DuckDuckArgumentError(
+                "Argument 'container' must be one of the values: "
+                "{0}".format(', '.join(Hook.containers)))
+
+        self.container = container
+        self.verbose = verbose
+        self.headers = {"User-Agent": user_agent}
+        if secure:
+            self.connection_class = http_client.HTTPSConnection
+        else:
+            self.connection_class = http_client.HTTPConnection
+        self.connection_kwargs = {}
+        if timeout is not None:
+            self.connection_kwargs['timeout'] = timeout
+        # Everything what follows the empty 'q' parameter.
+        self._url_suffix = url_assembler(
+            '',
+            no_redirect=no_redirect,
+            no_html=no_html,
+            skip_disambig=skip_disambig,
+            lang=lang)[len('/?q='):]
+
+    def url(self, query_string):
+        """Returns a part of the request URL for 'query_string'."""
+        return '/?q=' + quote_plus(query_string) + self._url_suffix
+
+    def __call__(self, query_string):
+        """Sends 'query_string' to DuckDuckGo API. See query function."""
+        conn = self.connection_class(api.SERVER_HOST, **self.connection_kwargs)
+        try:
+            conn.request("GET", self.url(query_string), "", self.headers)
+            resp = conn.getresponse()
+            data = read_response(resp)
+        except socket.gaierror as e:
+            raise exc.DuckDuckConnectionError(e.strerror)
+        except socket.timeout:
+            raise exc.DuckDuckConnectionError("Request has timed out")
+        finally:
+            conn.close()
+
+        hook = Hook(self.container, verbose=self.verbose)
+        try:
+            obj = json.loads(data, object_hook=hook)
+        except ValueError:
+            raise exc.DuckDuckDeserializeError(
+                "Unable to deserialize response to an object")
+
+        return obj
 
 
 secure_query = functools.partial(query, secure=True)
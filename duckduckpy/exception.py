@@ -43,3 +43,29 @@ class DuckDuckArgumentError(DuckDuckException):
     """Indicates that argument is wrong
     """
     pass
+
+
+class DuckDuckCircuitOpenError(DuckDuckConnectionError):
+    """Raised when a request isn't sent because the circuit breaker is open.
+    """
+    pass
+
+
+class DuckDuckOverloadError(DuckDuckException):
+    """Raised when a request is shed because too many requests are in flight.
+    """
+    pass
+
+
+class DuckDuckDeadlineError(DuckDuckException):
+    """Raised when a request is dropped because its deadline has passed
+    before it was sent.
+    """
+    pass
+
+
+class DuckDuckTimeoutError(DuckDuckException):
+    """Raised when a response isn't ready in time the caller waits for it.
+    The request itself isn't cancelled.
+    """
+    pass
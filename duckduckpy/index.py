@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+from . import exception as exc
+from .utils import decoder
+
+from itertools import chain
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows.
+    fcntl = None
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+MAGIC = b'DDPYIDX2'
+# File header: magic and generation, which changes on every compaction.
+_HEADER = struct.Struct('<8s8s')
+# Record header: sync marker, data length and CRC-32 of the data.
+_SYNC = b'\xd5\xdbIX'
+_RECORD = struct.Struct('<4sII')
+EXACT_FIELDS = ('first_url', 'entity', 'type')
+
+
+def tokenize(text):
+    """Splits 'text' into lowercase word tokens."""
+    return [token.lower() for token in _TOKEN.findall(text or '')]
+
+
+def _flock(f, exclusive=True):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def _funlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def _pack_record(record):
+    data = json.dumps(record).encode('utf-8')
+    return _RECORD.pack(_SYNC, len(data), _crc32(data)) + data
+
+
+def _field(obj, name):
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _related_topics(topics):
+    for topic in topics or ():
+        if _field(topic, 'topics') is not None:
+            for result in _related_topics(_field(topic, 'topics')):
+                yield result
+        else:
+            yield topic
+
+
+class ResultIndex(object):
+    """Local inverted index over cached responses.
+
+    Responses are indexed by tokens of 'heading', 'abstract_text' and the
+    texts of results and related topics, and by exact values of 'first_url',
+    'entity' and 'type'. Lookups return cache keys of matching responses, so
+    that the responses themselves can be taken from a ResponseCache.
+
+    The index is kept in an append-only file of framed records, which is
+    read through 'mmap'. Several worker processes can share the same file:
+    every 'add' appends a record, and 'refresh' picks up the records
+    appended by other processes since the last call. Every record carries
+    a sync marker and a checksum, so records broken by a writer which died
+    mid-append are skipped. Once the file is larger than 'compact_size'
+    and most of its records are replaced ones, it is compacted.
+
+    Args:
+        path: Path to the index file. Created if it doesn't exist.
+        compact_size: Size of the file in bytes after which it may be
+            compacted or None to never compact automatically.
+            Default value: 1 MiB.
+
+    Raises:
+        DuckDuckDeserializeError: The file isn't an index file.
+
+    Usage:
+        >>> cache = ResponseCache()
+        >>> index = ResultIndex('/tmp/duckduckpy.idx')
+        >>> cache.subscribe(index.add)
+        >>> response = cache.query('Python')
+        >>> index.search('programming language')
+        set([(u'Python', ())])
+    """
+
+    def __init__(self, path, compact_size=1 << 20):
+        self.path = path
+        self.compact_size = compact_size
+        self._generation = None
+        self._lock = threading.RLock()
+        self._reset()
+        self._open_for_append().close()
+        self.refresh()
+
+    def _reset(self):
+        self._offset = _HEADER.size
+        self._records = 0
+        self._documents = {}
+        self._tokens = {}
+        self._exact = dict((name, {}) for name in EXACT_FIELDS)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, key):
+        return key in self._documents
+
+    def _open_for_append(self):
+        """Opens the current index file and locks it for writing."""
+        while True:
+            f = open(self.path, 'ab')
+            _flock(f)
+            stat = os.fstat(f.fileno())
+            # The file might have been replaced by compaction meanwhile.
+            if fcntl is None or stat.st_ino == os.stat(self.path).st_ino:
+                break
+            _funlock(f)
+            f.close()
+        if stat.st_size == 0:
+            f.write(_HEADER.pack(MAGIC, os.urandom(8)))
+            f.flush()
+        return f
+
+    def add(self, key, response):
+        """Indexes 'response' cached under 'key'.
+
+        A response which is indexed under the same key already is replaced.
+        """
+        texts = [_field(response, 'heading'),
+                 _field(response, 'abstract_text')]
+        first_urls = []
+        topics = _related_topics(_field(response, 'related_topics'))
+        for topic in chain(_field(response, 'results') or (), topics):
+            texts.append(_field(topic, 'text'))
+            first_urls.append(_field(topic, 'first_url'))
+        record = {
+            'key': [key[0], [list(option) for option in key[1]]],
+            'tokens': sorted(set(token for text in texts
+                                 for token in tokenize(text))),
+            'first_url': sorted(set(url for url in first_urls if url)),
+            'entity': [_field(response, 'entity')],
+            'type': [_field(response, 'type')]}
+
+        f = self._open_for_append()
+        try:
+            f.write(_pack_record(record))
+            f.flush()
+        finally:
+            _funlock(f)
+            f.close()
+        self.refresh()
+        if (self.compact_size is not None and
+                self._offset > self.compact_size and
+                self._records > 2 * len(self._documents)):
+            self.compact()
+
+    def refresh(self):
+        """Loads records appended to the index file since the last call.
+
+        If the file has been compacted meanwhile, it is loaded anew.
+
+        Returns:
+            Number of loaded records.
+        """
+        with self._lock:
+            return self._refresh(locked=False)
+
+    def _refresh(self, locked):
+        with open(self.path, 'rb') as f:
+            if not locked:
+                _flock(f, exclusive=False)
+            try:
+                size = os.fstat(f.fileno()).st_size
+                if size < _HEADER.size:
+                    return 0
+                # Records are never changed once written, so the mapped
+                # part of the file can be read without the lock.
+                mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            finally:
+                if not locked:
+                    _funlock(f)
+        try:
+            magic, generation = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise exc.DuckDuckDeserializeError(
+                    "File '{0}' is not an index file".format(self.path))
+            if generation != self._generation:
+                self._reset()
+                self._generation = generation
+            return self._read_records(mm, size)
+        finally:
+            mm.close()
+
+    def _read_records(self, mm, size):
+        offset, loaded = self._offset, 0
+        while offset + _RECORD.size <= size:
+            sync, length, crc = _RECORD.unpack_from(mm, offset)
+            start = offset + _RECORD.size
+            end = start + length
+            if sync == _SYNC and end <= size:
+                record = self._parse(mm[start:end], crc)
+                if record is not None:
+                    self._apply(record)
+                    offset = end
+                    loaded += 1
+                    continue
+            elif sync == _SYNC and mm.find(_SYNC, start, size) == -1:
+                # Nothing follows, the record may be still being written
+                # where file locks aren't available.
+                break
+            # A broken record, e.g. left by a writer which died mid-append.
+            # Skip to the next sync marker.
+            offset = mm.find(_SYNC, offset + 1, size)
+            if offset == -1:
+                offset = size
+        self._offset = offset
+        return loaded
+
+    def _parse(self, data, crc):
+        if _crc32(data) != crc:
+            return None
+        try:
+            return json.loads(decoder(data))
+        except ValueError:
+            return None
+
+    def compact(self):
+        """Rewrites the index file keeping the live records only.
+
+        Other processes sharing the file load it anew on their next refresh.
+        """
+        with self._lock:
+            f = self._open_for_append()
+            try:
+                self._refresh(locked=True)
+                tmp_path = self.path + '.compact'
+                with open(tmp_path, 'wb') as tmp:
+                    tmp.write(_HEADER.pack(MAGIC, os.urandom(8)))
+                    for key, record in self._documents.items():
+                        query_string, options = key
+                        record = dict(record, key=[
+                            query_string,
+                            [list(option) for option in options]])
+                        tmp.write(_pack_record(record))
+                getattr(os, 'replace', os.rename)(tmp_path, self.path)
+            finally:
+                _funlock(f)
+                f.close()
+            self._refresh(locked=False)
+
+    def _apply(self, record):
+        self._records += 1
+        query_string, options = record.pop('key')
+        key = (query_string, tuple(tuple(option) for option in options))
+        self._discard(key)
+        self._documents[key] = record
+        for token in record['tokens']:
+            self._tokens.setdefault(token, set()).add(key)
+        for name in EXACT_FIELDS:
+            for value in record[name]:
+                if value:
+                    self._exact[name].setdefault(value, set()).add(key)
+
+    def _discard(self, key):
+        record = self._documents.pop(key, None)
+        if record is None:
+            return
+        postings = [(self._tokens, token) for token in record['tokens']]
+        for name in EXACT_FIELDS:
+            postings.extend((self._exact[name], value)
+                            for value in record[name] if value)
+        for mapping, value in postings:
+            keys = mapping.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del mapping[value]
+
+    def search(self, text):
+        """Returns keys of responses which contain all the words of 'text'."""
+        tokens = tokenize(text)
+        if not tokens:
+            return set()
+        with self._lock:
+            postings = [self._tokens.get(token, set()) for token in tokens]
+            postings.sort(key=len)
+            return set(postings[0]).intersection(*postings[1:])
+
+    def _lookup(self, name, value):
+        with self._lock:
+            return set(self._exact[name].get(value, ()))
+
+    def by_first_url(self, first_url):
+        """Returns keys of responses which refer to 'first_url'."""
+        return self._lookup('first_url', first_url)
+
+    def by_entity(self, entity):
+        """Returns keys of responses of 'entity'."""
+        return self._lookup('entity', entity)
+
+    def by_type(self, response_type):
+        """Returns keys of responses of 'response_type' type."""
+        return self._lookup('type', response_type)
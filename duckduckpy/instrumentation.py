@@ -0,0 +1,51 @@
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+import threading
+
+_providers = {}
+_lock = threading.Lock()
+
+
+def register(name, provider):
+    """Registers statistics provider under 'name', replacing the old one.
+
+    Args:
+        name: Name of the provider in the snapshot.
+        provider: A callable returning a dict of current statistics.
+    """
+    with _lock:
+        _providers[name] = provider
+
+
+def unregister(name):
+    """Removes provider registered under 'name' if any."""
+    with _lock:
+        _providers.pop(name, None)
+
+
+def snapshot():
+    """Returns a dict with statistics of all the registered providers."""
+    with _lock:
+        providers = list(_providers.items())
+    return dict((name, provider()) for name, provider in providers)
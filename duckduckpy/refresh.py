@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+from . import core
+from .cache import cache_key
+from .utils import TokenBucket
+
+import heapq
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RefreshAhead(object):
+    """Keeps popular cache entries warm by re-fetching them before expiry.
+
+    Each access to a key bumps its frequency score, which decays over time
+    with the given half-life. The 'top' keys by score whose entries expire
+    within 'lead_time' seconds are re-fetched through core.query in the
+    background, but no more than 'rate' of them per second.
+
+    Args:
+        cache: ResponseCache instance to keep warm.
+        top: Number of the most frequently accessed keys to refresh.
+            Default value: 1000.
+        lead_time: Number of seconds before expiry an entry is refreshed.
+            Default value: 30.
+        rate: Maximum number of background refreshes per second.
+            Default value: 5.
+        half_life: Number of seconds in which an access score is halved.
+            Default value: 300.
+        interval: Number of seconds between refresh passes. Default value: 1.
+        clock: A callable returning the current time in seconds.
+
+    Usage:
+        >>> cache = ResponseCache(ttl=600)
+        >>> refresher = RefreshAhead(cache, top=2000)
+        >>> refresher.start()
+        >>> response = refresher.query('Python')
+        >>> refresher.stop()
+    """
+
+    # Scores below this value are forgotten on every refresh pass.
+    min_score = 0.01
+
+    def __init__(self, cache, top=1000, lead_time=30, rate=5, half_life=300,
+                 interval=1, clock=time.time):
+        self.cache = cache
+        self.top = top
+        self.lead_time = lead_time
+        self.half_life = float(half_life)
+        self.interval = interval
+        self._clock = clock
+        self._budget = TokenBucket(rate, clock=clock)
+        self._scores = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pass_lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+        self._loop = None
+        self._handle = None
+        # Number of refreshes failed since start.
+        self.failures = 0
+
+    def _decayed(self, entry, now):
+        score, stamp = entry
+        return score * 0.5 ** (max(0.0, now - stamp) / self.half_life)
+
+    def record(self, key):
+        """Registers an access to 'key'."""
+        now = self._clock()
+        with self._lock:
+            entry = self._scores.get(key)
+            score = self._decayed(entry, now) if entry else 0.0
+            self._scores[key] = (score + 1.0, now)
+
+    def score(self, key):
+        """Returns the current decayed access score of 'key'."""
+        entry = self._scores.get(key)
+        if entry is None:
+            return 0.0
+        return self._decayed(entry, self._clock())
+
+    def query(self, query_string, **kwargs):
+        """Same as ResponseCache.query, but records the access first."""
+        self.record(cache_key(query_string, **kwargs))
+        return self.cache.query(query_string, **kwargs)
+
+    def hot(self):
+        """Returns up to 'top' keys with the highest access scores."""
+        now = self._clock()
+        with self._lock:
+            scored = [(self._decayed(entry, now), key)
+                      for key, entry in self._scores.items()]
+        return [key for _, key in heapq.nlargest(
+            self.top, scored, key=lambda item: item[0])]
+
+    def due(self):
+        """Returns hot keys whose cache entries expire within lead time."""
+        deadline = self._clock() + self.lead_time
+        keys = []
+        for key in self.hot():
+            expires_at = self.cache.expires_at(key)
+            if expires_at is not None and expires_at <= deadline:
+                keys.append(key)
+        return keys
+
+    def refresh(self, key):
+        """Re-fetches 'key' through core.query and stores it in the cache."""
+        query_string, options = key
+        self.cache.set(key, core.query(query_string, **dict(options)))
+
+    def _prune(self):
+        now = self._clock()
+        with self._lock:
+            for key, entry in list(self._scores.items()):
+                if self._decayed(entry, now) < self.min_score:
+                    del self._scores[key]
+
+    def run_once(self):
+        """Refreshes due entries within the rate budget.
+
+        A failed refresh is logged and counted in 'failures', and the pass
+        goes on with the next key. Passes never run concurrently.
+
+        Returns:
+            Number of refreshed entries.
+        """
+        with self._pass_lock:
+            self._idle.clear()
+            try:
+                return self._refresh_due()
+            finally:
+                self._idle.set()
+
+    def _refresh_due(self):
+        self._prune()
+        refreshed = 0
+        for key in self.due():
+            if self._stopped.is_set() or not self._budget.consume():
+                break
+            try:
+                self.refresh(key)
+            except Exception:
+                self.failures += 1
+                log.warning("Unable to refresh %r", key, exc_info=True)
+                continue
+            refreshed += 1
+        return refreshed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("Refresh pass failed")
+
+    def start(self):
+        """Starts refreshing in a background daemon thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='duckduckpy-refresh-ahead')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def start_async(self, loop):
+        """Starts refreshing on asyncio 'loop'.
+
+        Refresh passes are run in the default executor of the loop, so that
+        blocking core.query calls don't stall the loop.
+        """
+        self._stopped.clear()
+        self._loop = loop
+        self._handle = loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        if self._stopped.is_set():
+            return
+        future = self._loop.run_in_executor(None, self.run_once)
+        future.add_done_callback(self._reschedule)
+
+    def _reschedule(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error("Refresh pass failed", exc_info=future.exception())
+        if not self._stopped.is_set():
+            self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def stop(self, timeout=None):
+        """Stops refreshing and waits for a running refresh pass to finish.
+
+        Args:
+            timeout: Maximum number of seconds to wait or None to wait
+                until the pass finishes.
+        """
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._idle.wait(timeout)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
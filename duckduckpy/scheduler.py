@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+from . import core
+from . import exception as exc
+from .utils import TokenBucket
+
+from collections import deque
+from collections import namedtuple
+import heapq
+import itertools
+import threading
+import time
+
+# Parameters of a class of requests: 'weight' is its share of capacity
+# relative to the other classes, 'concurrency' is the maximum number of its
+# concurrent requests and 'deadline' is the default number of seconds its
+# requests may wait in the queue. The last two can be None for no limit.
+PriorityClass = namedtuple('PriorityClass',
+                           ['weight', 'concurrency', 'deadline'])
+
+DEFAULT_CLASSES = {
+    'interactive': PriorityClass(weight=8, concurrency=None, deadline=5),
+    'batch': PriorityClass(weight=1, concurrency=None, deadline=None)}
+
+_Request = namedtuple('_Request', ['tag', 'seq', 'ticket', 'expires_at',
+                                   'query_string', 'kwargs'])
+
+
+class Ticket(object):
+    """Pending result of a request submitted to PriorityScheduler."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def _set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        """Returns True if the request has completed or has been dropped."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Waits for and returns the response.
+
+        Raises:
+            DuckDuckDeadlineError: The request was dropped because its
+                deadline has passed before it was sent.
+            DuckDuckTimeoutError: The response wasn't ready in 'timeout'
+                seconds. The request stays queued.
+            The same exceptions as core.query.
+        """
+        if not self._done.wait(timeout):
+            raise exc.DuckDuckTimeoutError(
+                "Response is not ready in {0} seconds".format(timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class PriorityScheduler(object):
+    """Schedules queries of different priority classes on worker threads.
+
+    Requests are picked with weighted fair queuing: each class gets the
+    share of workers proportional to its weight while it has queued
+    requests, and idle capacity goes to the other classes. A class can
+    also be limited in the number of concurrent requests. Requests whose
+    deadline has passed are dropped before they are sent, wherever they
+    are in the queue and even while all the workers are busy.
+
+    Args:
+        workers: Number of worker threads, i.e. concurrent requests.
+            Default value: 4.
+        classes: A dict of class names to PriorityClass.
+            Default value: DEFAULT_CLASSES.
+        rate: Maximum number of requests per second across all classes or
+            None. Default value: None.
+        query: A callable sending the requests, e.g. ResponseCache.query or
+            CircuitBreaker.query. Default value: core.query.
+        clock: A callable returning the current time in seconds.
+
+    Usage:
+        >>> scheduler = PriorityScheduler(workers=8, rate=20)
+        >>> ticket = scheduler.submit('Python', priority='batch')
+        >>> response = scheduler.query('Python', priority='interactive')
+        >>> ticket.result()
+        Response(redirect=u'', definition=u'', image_width=0, ...}
+        >>> scheduler.shutdown()
+    """
+
+    def __init__(self, workers=4, classes=None, rate=None, query=None,
+                 clock=time.time):
+        self.classes = dict(classes or DEFAULT_CLASSES)
+        self._query = query
+        self._clock = clock
+        self._budget = TokenBucket(rate, clock=clock) if rate else None
+        self._queues = dict((name, deque()) for name in self.classes)
+        self._finish = dict.fromkeys(self.classes, 0.0)
+        self._in_flight = dict.fromkeys(self.classes, 0)
+        # Heap of (expires_at, seq) of the queued requests with deadline and
+        # the requests themselves by seq. Taken requests are removed from
+        # the dict right away and from the heap lazily.
+        self._expiries = []
+        self._expiring = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._work, name='duckduckpy-scheduler-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._reap,
+                                  name='duckduckpy-scheduler-reaper')
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, query_string, priority='interactive', deadline=None,
+               **kwargs):
+        """Queues 'query_string' for sending.
+
+        Args:
+            query_string: Query to be passed to DuckDuckGo API.
+            priority: Name of the priority class. Default - 'interactive'.
+            deadline: Number of seconds the request may wait in the queue.
+                Default value: the deadline of the priority class.
+            kwargs: Other arguments of core.query.
+
+        Raises:
+            DuckDuckArgumentError: Priority class is unknown.
+
+        Returns:
+            Ticket instance.
+        """
+        if priority not in self.classes:
+            raise exc.DuckDuckArgumentError(
+                "Argument 'priority' must be one of the values: "
+                "{0}".format(', '.join(sorted(self.classes))))
+        priority_class = self.classes[priority]
+        if deadline is None:
+            deadline = priority_class.deadline
+        expires_at = None
+        if deadline is not None:
+            expires_at = self._clock() + deadline
+
+        ticket = Ticket()
+        with self._cond:
+            if self._stopped:
+                raise exc.DuckDuckException("Scheduler is shut down")
+            # Virtual finish time of the request in weighted fair queuing.
+            tag = (max(self._virtual_time, self._finish[priority]) +
+                   1.0 / priority_class.weight)
+            self._finish[priority] = tag
+            request = _Request(tag, next(self._seq), ticket, expires_at,
+                               query_string, kwargs)
+            self._queues[priority].append(request)
+            if expires_at is not None:
+                heapq.heappush(self._expiries, (expires_at, request.seq))
+                self._expiring[request.seq] = request
+            # Workers and the reaper wait on the same condition, so a single
+            # wakeup could go to the reaper and leave the request queued.
+            self._cond.notify_all()
+        return ticket
+
+    def query(self, query_string, priority='interactive', deadline=None,
+              **kwargs):
+        """Same as submit, but waits for and returns the response."""
+        return self.submit(query_string, priority=priority,
+                           deadline=deadline, **kwargs).result()
+
+    def _drop_expired(self):
+        now = self._clock()
+        while self._expiries and (self._expiries[0][0] <= now or
+                                  self._expiries[0][1] not in self._expiring):
+            request = self._expiring.pop(
+                heapq.heappop(self._expiries)[1], None)
+            # Dropped tickets are removed from the queues lazily.
+            if request is not None and not request.ticket.done():
+                request.ticket._set_error(exc.DuckDuckDeadlineError(
+                    "Request is dropped, its deadline has passed"))
+
+    def _next(self):
+        self._drop_expired()
+        best = None
+        for name, queue in self._queues.items():
+            while queue and queue[0].ticket.done():
+                queue.popleft()
+            limit = self.classes[name].concurrency
+            if not queue or (limit is not None and
+                             self._in_flight[name] >= limit):
+                continue
+            if best is None or queue[0][:2] < self._queues[best][0][:2]:
+                best = name
+        return best
+
+    def _wait_time(self):
+        """Returns how long an idle worker may sleep before rechecking."""
+        if self._budget is not None and any(self._queues.values()):
+            return 1.0 / self._budget.rate
+        if self._expiries:
+            return max(0.0, self._expiries[0][0] - self._clock())
+        return None
+
+    def _reap(self):
+        # Fails expired requests while all the workers are busy.
+        with self._cond:
+            while not self._stopped:
+                self._drop_expired()
+                self._cond.wait(self._wait_time())
+
+    def _forget_expiry(self, request):
+        if self._expiring.pop(request.seq, None) is None:
+            return
+        if len(self._expiries) > 2 * len(self._expiring) + 64:
+            self._expiries = [entry for entry in self._expiries
+                              if entry[1] in self._expiring]
+            heapq.heapify(self._expiries)
+
+    def _take(self):
+        with self._cond:
+            while not self._stopped:
+                name = self._next()
+                if name is not None and (self._budget is None or
+                                         self._budget.consume()):
+                    request = self._queues[name].popleft()
+                    self._forget_expiry(request)
+                    self._virtual_time = request.tag
+                    self._in_flight[name] += 1
+                    return name, request
+                self._cond.wait(self._wait_time())
+        return None, None
+
+    def _work(self):
+        while True:
+            name, request = self._take()
+            if request is None:
+                return
+            query = self._query or core.query
+            try:
+                request.ticket._set_result(
+                    query(request.query_string, **request.kwargs))
+            except Exception as e:
+                request.ticket._set_error(e)
+            finally:
+                with self._cond:
+                    self._in_flight[name] -= 1
+                    self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        """Stops workers and fails the queued requests.
+
+        Args:
+            wait: Wait for requests being sent to complete.
+        """
+        with self._cond:
+            self._stopped = True
+            for queue in self._queues.values():
+                while queue:
+                    ticket = queue.popleft().ticket
+                    if not ticket.done():
+                        ticket._set_error(
+                            exc.DuckDuckException("Scheduler is shut down"))
+            del self._expiries[:]
+            self._expiring.clear()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+# Copyright (c) 2015 Ivan Kliuk
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+# OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+from . import api
+from . import exception as exc
+
+import marshal
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b'DDPYSNAP'
+VERSION = 2
+# Magic, format version, marshal version and Python major/minor version,
+# since marshal format isn't guaranteed to be stable across Python versions.
+_HEADER = struct.Struct('<8sBBBB')
+_FOOTER = struct.Struct('<Q8s')
+
+
+def _fields():
+    return dict((name, getattr(api, name)._fields)
+                for name in ('Icon', 'Result', 'RelatedTopic', 'Response'))
+
+
+# Values are stored as they are, except for subtrees which have to be
+# rebuilt on load. Those are replaced by tuples whose first item tells
+# how: '(' for a plain tuple, '[' for a list and '{' for a dict holding
+# such subtrees, or a name of api namedtuple class otherwise.
+def _pack(obj):
+    if isinstance(obj, tuple):
+        if hasattr(obj, '_fields'):
+            return (type(obj).__name__,) + tuple(map(_pack, obj))
+        return ('(',) + tuple(map(_pack, obj))
+    if isinstance(obj, list):
+        items = list(map(_pack, obj))
+        if any(type(item) is tuple for item in items):
+            return ('[', items)
+    if isinstance(obj, dict):
+        items = dict((key, _pack(value)) for key, value in obj.items())
+        if any(type(value) is tuple for value in items.values()):
+            return ('{', items)
+    return obj
+
+
+def _unpack(obj):
+    tag = obj[0]
+    if tag == '[':
+        return [_unpack(item) if type(item) is tuple else item
+                for item in obj[1]]
+    if tag == '{':
+        return dict((key, _unpack(value) if type(value) is tuple else value)
+                    for key, value in obj[1].items())
+    values = [_unpack(value) if type(value) is tuple else value
+              for value in obj[1:]]
+    if tag == '(':
+        return tuple(values)
+    return getattr(api, tag)._make(values)
+
+
+def _header():
+    return _HEADER.pack(MAGIC, VERSION, marshal.version,
+                        sys.version_info[0], sys.version_info[1])
+
+
+def dump(cache, path):
+    """Writes all the entries of 'cache' to snapshot file at 'path'.
+
+    The file consists of a header, 'marshal' serialized records and an
+    offset index of the records followed by a footer pointing to the index.
+    The index also keeps the field names of api namedtuples, which are
+    stored positionally.
+    The file is written under a temporary name and then renamed, so that
+    readers never see a partially written snapshot. If the cache has a
+    Snapshot as its fallback, entries which haven't been loaded from it are
+    copied over as they are.
+
+    Args:
+        cache: ResponseCache instance.
+        path: Path to the snapshot file.
+
+    Returns:
+        Number of written entries.
+    """
+    index = {}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_header())
+        offset = _HEADER.size
+
+        def write(key, data, expires_at):
+            f.write(data)
+            index[key] = (offset, len(data), expires_at)
+            return offset + len(data)
+
+        fallback = cache.fallback
+        if not isinstance(fallback, Snapshot):
+            fallback = None
+        for key, value, expires_at in cache.entries(
+                include_fallback=fallback is None):
+            offset = write(key, marshal.dumps(_pack(value)), expires_at)
+        if fallback is not None:
+            for key in fallback.keys():
+                if key not in index:
+                    offset = write(key, *fallback._record(key))
+        f.write(marshal.dumps((_fields(), index)))
+        f.write(_FOOTER.pack(offset, MAGIC))
+    getattr(os, 'replace', os.rename)(tmp_path, path)
+    return len(index)
+
+
+class Snapshot(object):
+    """Read-only view of a snapshot file written by 'dump'.
+
+    The file is memory-mapped and only the offset index is loaded on open.
+    Entries are deserialized lazily on access, into the same namedtuple or
+    dict objects the cached responses were.
+
+    Args:
+        path: Path to the snapshot file.
+
+    Raises:
+        DuckDuckDeserializeError: The file isn't a valid snapshot.
+
+    Usage:
+        >>> snapshot.dump(cache, '/var/cache/duckduckpy.snap')
+        >>> # After restart.
+        >>> cache = ResponseCache(
+        ...     fallback=snapshot.Snapshot('/var/cache/duckduckpy.snap'))
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            self._index = self._load_index()
+        except (ValueError, EOFError, TypeError, struct.error):
+            self.close()
+            raise exc.DuckDuckDeserializeError(
+                "File '{0}' is not a valid snapshot".format(path))
+        except exc.DuckDuckDeserializeError:
+            self.close()
+            raise
+
+    def _load_index(self):
+        size = len(self._mmap)
+        header = self._mmap[:_HEADER.size]
+        magic, version = _HEADER.unpack(header)[:2]
+        index_offset, footer_magic = _FOOTER.unpack_from(
+            self._mmap, size - _FOOTER.size)
+        if magic != MAGIC or footer_magic != MAGIC:
+            raise ValueError(magic)
+        if version != VERSION:
+            raise exc.DuckDuckDeserializeError(
+                "Snapshot version {0} is not supported".format(version))
+        if header != _header():
+            raise exc.DuckDuckDeserializeError(
+                "Snapshot was written by another Python or marshal version")
+        fields, index = marshal.loads(
+            self._mmap[index_offset:size - _FOOTER.size])
+        if fields != _fields():
+            raise exc.DuckDuckDeserializeError(
+                "Snapshot was written for different api namedtuples")
+        return index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        """Returns a list of all the keys in the snapshot."""
+        return list(self._index)
+
+    def _record(self, key):
+        offset, length, expires_at = self._index[key]
+        return self._mmap[offset:offset + length], expires_at
+
+    def expires_at(self, key):
+        """Returns expiration time of 'key' or None if it's missing."""
+        location = self._index.get(key)
+        if location is None:
+            return None
+        return location[2]
+
+    def entry(self, key):
+        """Returns (value, expires_at) for 'key' or None if it's missing."""
+        if key not in self._index:
+            return None
+        data, expires_at = self._record(key)
+        value = marshal.loads(data)
+        if type(value) is tuple:
+            value = _unpack(value)
+        return value, expires_at
+
+    def get(self, key, default=None):
+        """Returns value for 'key' or 'default' if it's missing."""
+        entry = self.entry(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def close(self):
+        """Unmaps and closes the snapshot file."""
+        mapped = getattr(self, '_mmap', None)
+        if mapped is not None:
+            mapped.close()
+            self._mmap = None
+        self._file.close()
+
+
+def restore(cache, path, lazy=True):
+    """Restores entries of 'cache' from snapshot file at 'path'.
+
+    Args:
+        cache: ResponseCache instance.
+        path: Path to the snapshot file.
+        lazy: If True, the snapshot becomes the fallback of 'cache', so
+            that entries are deserialized on the first access. Otherwise
+            all the entries are loaded into 'cache' right away.
+            Default value: True.
+
+    Returns:
+        Snapshot instance.
+    """
+    snapshot = Snapshot(path)
+    if lazy:
+        cache.fallback = snapshot
+        return snapshot
+    for key in snapshot.keys():
+        value, expires_at = snapshot.entry(key)
+        cache.set(key, value, expires_at=expires_at)
+    return snapshot
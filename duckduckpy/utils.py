@@ -23,11 +23,26 @@
 
 from __future__ import unicode_literals
 
-import re
+import codecs
 import sys
+import threading
+import time
 
-_1 = re.compile(r'(.)([A-Z][a-z]+)')
-_2 = re.compile('([a-z0-9])([A-Z])')
+_1 = r'(.)([A-Z][a-z]+)'
+_2 = '([a-z0-9])([A-Z])'
+_compiled = {}
+
+# Characters which are left as is by quote_plus. As in the standard library,
+# '~' is quoted before Python 3.7, which switched to RFC 3986.
+_SAFE = ('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+         '0123456789_.-')
+if sys.version_info >= (3, 7):
+    _SAFE += '~'
+_SAFE_BYTES = _SAFE.encode('ascii')
+_QUOTED = ['%{0:02X}'.format(i) for i in range(256)]
+for _c in _SAFE:
+    _QUOTED[ord(_c)] = _c
+_QUOTED[ord(' ')] = '+'
 
 
 def is_python2():
@@ -35,13 +50,22 @@ def is_python2():
     return sys.version_info[0] == 2
 
 
+def _pattern(regex):
+    """Compiles 'regex' on first use."""
+    pattern = _compiled.get(regex)
+    if pattern is None:
+        import re
+        pattern = _compiled[regex] = re.compile(regex)
+    return pattern
+
+
 def camel_to_snake_case(string):
     """Converts 'string' presented in camel case to snake case.
 
     e.g.: CamelCase => snake_case
     """
-    s = _1.sub(r'\1_\2', string)
-    return _2.sub(r'\1_\2', s).lower()
+    s = _pattern(_1).sub(r'\1_\2', string)
+    return _pattern(_2).sub(r'\1_\2', s).lower()
 
 
 def camel_to_snake_case_set(seq):
@@ -49,8 +73,110 @@ def camel_to_snake_case_set(seq):
     return set(map(camel_to_snake_case, seq))
 
 
+def quote_plus(string):
+    """Percent-encodes UTF-8 representation of 'string' for a URL query.
+
+    A faster equivalent of 'quote_plus' from the standard library of the
+    running Python with the default set of safe characters.
+    """
+    data = string.encode('utf-8')
+    if not data.translate(None, _SAFE_BYTES):
+        return data.decode('ascii')
+    return ''.join([_QUOTED[i] for i in bytearray(data)])
+
+
 def decoder(obj):
-    """Decodes 'bytes' object to UTF-8."""
+    """Decodes 'bytes' object to UTF-8.
+
+    Buffers like 'bytearray' and 'memoryview' are decoded in place, without
+    making an intermediate 'bytes' copy.
+    """
     if isinstance(obj, bytes):
         return obj.decode("utf-8")
+    if isinstance(obj, (bytearray, memoryview)):
+        return codecs.utf_8_decode(obj, "strict", True)[0]
     return obj
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket used for keeping within a request budget.
+
+    Args:
+        rate: Number of tokens added per second.
+        capacity: Maximum number of tokens the bucket can hold.
+            Default value: 'rate' rounded up to at least one token.
+        clock: A callable returning the current time in seconds.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.time):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self._clock = clock
+        self._tokens = self.capacity
+        self._stamp = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = max(0.0, now - self._stamp)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._stamp = now
+
+    def consume(self, tokens=1):
+        """Takes 'tokens' from the bucket. Returns False if not enough."""
+        with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def available(self):
+        """Returns the number of tokens currently in the bucket."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class BufferPool(object):
+    """Thread-safe pool of reusable 'bytearray' buffers.
+
+    Buffer sizes are rounded up to the next power of two, so that buffers
+    can be reused for responses of slightly different length.
+
+    Args:
+        max_buffers: Maximum number of idle buffers kept in the pool.
+            Default value: 8.
+        max_size: Buffers larger than this are not returned to the pool.
+            Default value: 1 MiB.
+    """
+
+    min_size = 4096
+
+    def __init__(self, max_buffers=8, max_size=1 << 20):
+        self.max_buffers = max_buffers
+        self.max_size = max_size
+        self._free = []
+        self._lock = threading.Lock()
+
+    def _round(self, size):
+        rounded = self.min_size
+        while rounded < size:
+            rounded <<= 1
+        return rounded
+
+    def acquire(self, size):
+        """Returns a buffer which is at least 'size' bytes long."""
+        with self._lock:
+            for i, buf in enumerate(self._free):
+                if len(buf) >= size:
+                    return self._free.pop(i)
+        return bytearray(self._round(size))
+
+    def release(self, buf):
+        """Puts 'buf' back to the pool."""
+        if len(buf) > self.max_size:
+            return
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buf)
@@ -3,18 +3,44 @@
 from __future__ import unicode_literals
 import unittest
 from collections import Iterable
+from io import BytesIO
 from io import StringIO
+import json
 import mock
+import os
+import shutil
 import socket
+import subprocess
+import sys
+import tempfile
+import threading
 
+from duckduckpy import instrumentation
+from duckduckpy import snapshot
+from duckduckpy.batch import batch_query
+from duckduckpy.batch import normalize_term
+from duckduckpy.breaker import CircuitBreaker
+from duckduckpy.cache import cache_key
+from duckduckpy.cache import ResponseCache
 from duckduckpy.core import api
 from duckduckpy.core import Hook
+from duckduckpy.core import PreparedQuery
 from duckduckpy.core import query
+from duckduckpy.core import read_response
 from duckduckpy.core import secure_query
 from duckduckpy.core import url_assembler
 import duckduckpy.exception as exc
+from duckduckpy.index import ResultIndex
+from duckduckpy.index import tokenize
+from duckduckpy.refresh import RefreshAhead
+from duckduckpy.scheduler import PriorityClass
+from duckduckpy.scheduler import PriorityScheduler
+from duckduckpy.utils import BufferPool
 from duckduckpy.utils import camel_to_snake_case
+from duckduckpy.utils import decoder
 from duckduckpy.utils import is_python2
+from duckduckpy.utils import quote_plus
+from duckduckpy.utils import TokenBucket
 
 
 class TestHook(unittest.TestCase):
@@ -442,6 +468,993 @@ class TestQueryExceptions(unittest.TestCase):
     def test_connection_error(self, *args):
         self.assertRaises(exc.DuckDuckConnectionError, query, 'anything!')
 
+    @mock.patch('duckduckpy.core.http_client.HTTPConnection.getresponse',
+                side_effect=socket.timeout)
+    def test_timeout_error(self, *args):
+        self.assertRaises(exc.DuckDuckConnectionError, query, 'anything!',
+                          timeout=1)
+
+    @mock.patch('json.loads')
+    @mock.patch('duckduckpy.core.http_client.HTTPConnection')
+    def test_timeout_passed_to_connection(self, conn, *args):
+        query('anything', timeout=1)
+        conn.assert_called_once_with(api.SERVER_HOST, timeout=1)
+
+
+# Benchmarks assert timing and allocation ratios, which are unreliable on
+# loaded machines, so they run on demand only:
+#   DUCKDUCKPY_BENCHMARKS=1 python -m unittest tests
+benchmark = unittest.skipUnless(os.environ.get('DUCKDUCKPY_BENCHMARKS'),
+                                'set DUCKDUCKPY_BENCHMARKS=1 to run')
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume_within_capacity(self):
+        bucket = TokenBucket(2, clock=FakeClock())
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, clock=clock)
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        clock.now += 1
+        self.assertTrue(bucket.consume())
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_cache_key_ignores_option_order(self):
+        self.assertEqual(cache_key('x', no_html=True, lang='ru-ru'),
+                         cache_key('x', lang='ru-ru', no_html=True))
+
+    def test_expired_entry(self):
+        clock = FakeClock()
+        cache = ResponseCache(ttl=10, clock=clock)
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        clock.now += 10
+        self.assertTrue(cache.get('key') is None)
+        self.assertEqual(cache.get('key', stale=True), 'value')
+
+    def test_maxsize(self):
+        cache = ResponseCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+
+    @mock.patch('duckduckpy.core.query', return_value='response')
+    def test_query_hits_cache(self, query_mock):
+        cache = ResponseCache()
+        self.assertEqual(cache.query('python', no_html=True), 'response')
+        self.assertEqual(cache.query('python', no_html=True), 'response')
+        query_mock.assert_called_once_with('python', no_html=True)
+
+
+class TestRefreshAhead(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(ttl=100, clock=self.clock)
+        self.refresher = RefreshAhead(self.cache, top=2, lead_time=10,
+                                      rate=1, half_life=60, clock=self.clock)
+
+    def test_score_decays(self):
+        self.refresher.record('key')
+        self.refresher.record('key')
+        self.assertEqual(self.refresher.score('key'), 2.0)
+        self.clock.now += 60
+        self.assertEqual(self.refresher.score('key'), 1.0)
+
+    def test_hot(self):
+        for key, hits in (('a', 1), ('b', 3), ('c', 2)):
+            for _ in range(hits):
+                self.refresher.record(key)
+        self.assertEqual(self.refresher.hot(), ['b', 'c'])
+
+    def test_due(self):
+        self.cache.set(cache_key('a'), 'a')
+        self.refresher.record(cache_key('a'))
+        self.assertEqual(self.refresher.due(), [])
+        self.clock.now += 95
+        self.assertEqual(self.refresher.due(), [cache_key('a')])
+
+    @mock.patch('duckduckpy.core.query', return_value='fresh')
+    def test_run_once_within_budget(self, query_mock):
+        for term in ('a', 'b'):
+            self.cache.set(cache_key(term, no_html=True), 'stale')
+            self.refresher.record(cache_key(term, no_html=True))
+        self.clock.now += 95
+        self.assertEqual(self.refresher.run_once(), 1)
+        query_mock.assert_called_once_with(mock.ANY, no_html=True)
+        self.clock.now += 1
+        self.assertEqual(self.refresher.run_once(), 1)
+        self.assertEqual(self.cache.get(cache_key('a', no_html=True)), 'fresh')
+        self.assertEqual(self.cache.get(cache_key('b', no_html=True)), 'fresh')
+
+    @mock.patch('duckduckpy.core.query',
+                side_effect=exc.DuckDuckConnectionError)
+    def test_run_once_failed_refresh(self, *args):
+        self.cache.set(cache_key('a'), 'stale')
+        self.refresher.record(cache_key('a'))
+        self.clock.now += 95
+        self.assertEqual(self.refresher.run_once(), 0)
+        self.assertEqual(self.cache.get(cache_key('a')), 'stale')
+        self.assertEqual(self.refresher.failures, 1)
+
+    @mock.patch('duckduckpy.core.query', side_effect=socket.error)
+    def test_socket_error_keeps_thread_alive(self, query_mock):
+        self.cache.set(cache_key('a'), 'stale')
+        refresher = RefreshAhead(self.cache, lead_time=10, interval=0.01,
+                                 clock=self.clock)
+        refresher.record(cache_key('a'))
+        self.clock.now += 95
+        refresher.start()
+        try:
+            for _ in range(500):
+                if refresher.failures >= 2:
+                    break
+                threading.Event().wait(0.01)
+            self.assertTrue(refresher.failures >= 2)
+            self.assertTrue(refresher._thread.is_alive())
+        finally:
+            refresher.stop(timeout=5)
+
+    def test_forgotten_scores(self):
+        self.refresher.record('key')
+        self.clock.now += 60 * 7
+        self.refresher.run_once()
+        self.assertEqual(self.refresher.hot(), [])
+
+    def test_thread_start_stop(self):
+        refresher = RefreshAhead(self.cache, interval=0.01)
+        passed = threading.Event()
+        with mock.patch.object(refresher, 'run_once', side_effect=passed.set):
+            refresher.start()
+            self.assertTrue(passed.wait(5))
+            refresher.stop(timeout=5)
+        self.assertTrue(refresher._thread is None)
+
+    def test_asyncio_start_stop(self):
+        if is_python2():
+            return
+        import asyncio
+        loop = asyncio.new_event_loop()
+        refresher = RefreshAhead(self.cache, interval=0.01)
+        passes = []
+
+        def run_once():
+            passes.append(1)
+            if len(passes) == 2:
+                loop.call_soon_threadsafe(loop.stop)
+
+        with mock.patch.object(refresher, 'run_once', side_effect=run_once):
+            refresher.start_async(loop)
+            loop.run_forever()
+            refresher.stop()
+        loop.close()
+        self.assertEqual(len(passes), 2)
+
+    def test_asyncio_failed_pass_logged(self):
+        if is_python2():
+            return
+        import asyncio
+        loop = asyncio.new_event_loop()
+        refresher = RefreshAhead(self.cache, interval=0.01)
+        passes = []
+
+        def run_once():
+            passes.append(1)
+            if len(passes) == 2:
+                loop.call_soon_threadsafe(loop.stop)
+            raise RuntimeError('broken')
+
+        with mock.patch.object(refresher, 'run_once', side_effect=run_once):
+            with mock.patch('duckduckpy.refresh.log') as log:
+                refresher.start_async(loop)
+                loop.run_forever()
+                refresher.stop()
+        loop.close()
+        self.assertEqual(len(passes), 2)
+        self.assertTrue(log.error.called)
+
+    def test_stop_waits_for_running_pass(self):
+        started, release = threading.Event(), threading.Event()
+        finished = []
+
+        def refresh_due():
+            started.set()
+            release.wait(5)
+            finished.append(1)
+            return 0
+
+        with mock.patch.object(self.refresher, '_refresh_due',
+                               side_effect=refresh_due):
+            thread = threading.Thread(target=self.refresher.run_once)
+            thread.start()
+            self.assertTrue(started.wait(5))
+            threading.Timer(0.05, release.set).start()
+            self.refresher.stop()
+            self.assertEqual(finished, [1])
+            thread.join(5)
+
+
+class FakeResponse(BytesIO):
+    def __init__(self, body, content_length=True):
+        # Initialized from a bytearray, so that every read() allocates.
+        BytesIO.__init__(self, bytearray(body))
+        self._length = len(body) if content_length else None
+
+    def getheader(self, name, default=None):
+        if name == 'Content-Length' and self._length is not None:
+            return str(self._length)
+        return default
+
+
+class TestReadResponse(unittest.TestCase):
+    body = '{"Heading": "Слава Україні"}'.encode('utf-8')
+
+    def test_decoder_buffers(self):
+        expected = self.body.decode('utf-8')
+        self.assertEqual(decoder(bytearray(self.body)), expected)
+        self.assertEqual(decoder(memoryview(self.body)), expected)
+
+    def test_pooled_read(self):
+        pool = BufferPool()
+        resp = FakeResponse(self.body)
+        self.assertEqual(read_response(resp, pool), self.body.decode('utf-8'))
+        self.assertEqual(len(pool._free), 1)
+
+    def test_buffer_reused(self):
+        pool = BufferPool()
+        read_response(FakeResponse(self.body), pool)
+        buf = pool._free[0]
+        read_response(FakeResponse(b'{}'), pool)
+        self.assertTrue(pool._free[0] is buf)
+
+    def test_no_content_length(self):
+        pool = BufferPool()
+        resp = FakeResponse(self.body, content_length=False)
+        self.assertEqual(read_response(resp, pool), self.body.decode('utf-8'))
+        self.assertEqual(pool._free, [])
+
+    def test_too_large_for_pool(self):
+        pool = BufferPool(max_size=8)
+        resp = FakeResponse(self.body)
+        self.assertEqual(read_response(resp, pool), self.body.decode('utf-8'))
+        self.assertEqual(pool._free, [])
+
+    def test_truncated_body(self):
+        resp = FakeResponse(self.body)
+        resp._length += 10
+        pool = BufferPool()
+        self.assertRaises(exc.DuckDuckConnectionError,
+                          read_response, resp, pool)
+        self.assertEqual(len(pool._free), 1)
+
+    @benchmark
+    def test_allocation_benchmark(self):
+        # Not relevant to Python 2.
+        if is_python2():
+            return
+        import tracemalloc
+        body = b'{"AbstractText": "' + b'x' * 256 * 1024 + b'"}'
+
+        def peak(pool, requests=20):
+            responses = [FakeResponse(body) for _ in range(requests)]
+            read_response(FakeResponse(body), pool)
+            tracemalloc.start()
+            try:
+                for resp in responses:
+                    read_response(resp, pool)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        pooled, unpooled = peak(BufferPool()), peak(None)
+        self.assertTrue(pooled < unpooled * 0.75, (pooled, unpooled))
+
+
+class TestPreparedQuery(unittest.TestCase):
+    terms = ['test query', 'Слава Україні', 'a&b=c/d!e_f.g-h~i', '']
+
+    def test_quote_plus(self):
+        self.assertEqual(quote_plus('Python'), 'Python')
+        self.assertEqual(quote_plus('a b+c'), 'a+b%2Bc')
+
+    def test_url_matches_url_assembler(self):
+        options = [{}, {'no_redirect': True, 'no_html': True},
+                   {'skip_disambig': True, 'lang': 'ru-ru'}]
+        for kwargs in options:
+            prepared = PreparedQuery(**kwargs)
+            for term in self.terms:
+                self.assertEqual(prepared.url(term),
+                                 url_assembler(term, **kwargs))
+
+    def test_argument_error(self):
+        self.assertRaises(exc.DuckDuckArgumentError,
+                          PreparedQuery, container='non-existent')
+
+    @mock.patch('json.loads')
+    @mock.patch('duckduckpy.core.http_client.HTTPSConnection')
+    def test_request(self, conn, *args):
+        prepared = PreparedQuery(secure=True, user_agent='agent')
+        prepared('test query')
+        prepared('python')
+        self.assertEqual(conn.call_count, 2)
+        conn.return_value.request.assert_called_with(
+            "GET", "/?q=python&format=json", "", {"User-Agent": "agent"})
+
+    @benchmark
+    def test_url_benchmark(self):
+        import timeit
+        prepared = PreparedQuery(no_html=True, lang='ru-ru')
+        number = 2000
+
+        def run(func):
+            return min(timeit.repeat(
+                lambda: [func(term) for term in self.terms],
+                number=number, repeat=3))
+
+        assembled = run(
+            lambda term: url_assembler(term, no_html=True, lang='ru-ru'))
+        self.assertTrue(run(prepared.url) < assembled)
+
+
+def mocked_query(container, body=TestQuery.origin):
+    with mock.patch('duckduckpy.core.http_client.HTTPConnection.request'):
+        with mock.patch(
+                'duckduckpy.core.http_client.HTTPConnection.getresponse',
+                return_value=StringIO(body)):
+            return query('python', container=container)
+
+
+class TestResultIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'results.idx')
+        self.index = ResultIndex(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Monty PythonA British, comedy'),
+                         ['monty', 'pythona', 'british', 'comedy'])
+        self.assertEqual(tokenize(None), [])
+
+    def assertIndexed(self, container):
+        key = cache_key('python', container=container)
+        self.index.add(key, mocked_query(container))
+        self.assertEqual(self.index.search('Python'), set([key]))
+        self.assertEqual(self.index.search('british COMEDY'), set([key]))
+        self.assertEqual(self.index.search('british ballet'), set())
+        self.assertEqual(
+            self.index.by_first_url('https://duckduckgo.com/Monty_Python'),
+            set([key]))
+        self.assertEqual(self.index.by_type('D'), set([key]))
+        self.assertEqual(self.index.by_entity(''), set())
+
+    def test_namedtuple(self):
+        self.assertIndexed('namedtuple')
+
+    def test_dict(self):
+        self.assertIndexed('dict')
+
+    def test_results(self):
+        body = TestQuery.origin.replace('"Results": [],', """"Results": [
+    {
+      "FirstURL": "https://www.python.org/",
+      "Icon": {
+        "Height": 16,
+        "URL": "https://duckduckgo.com/i/python.org.ico",
+        "Width": 16
+      },
+      "Result": "<a href=\\"https://www.python.org/\\">Official site</a>",
+      "Text": "Official site"
+    }
+  ],""")
+        keys = set()
+        for container in ('namedtuple', 'dict'):
+            key = cache_key('python', container=container)
+            self.index.add(key, mocked_query(container, body))
+            keys.add(key)
+            self.assertEqual(
+                self.index.by_first_url('https://www.python.org/'), keys)
+            self.assertEqual(self.index.search('official'), keys)
+
+    def test_replace(self):
+        key = cache_key('python')
+        self.index.add(key, {'heading': 'Python', 'type': 'D'})
+        self.index.add(key, {'heading': 'Monty', 'type': 'A'})
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.index.search('python'), set())
+        self.assertEqual(self.index.search('monty'), set([key]))
+        self.assertEqual(self.index.by_type('D'), set())
+
+    def test_shared_between_instances(self):
+        other = ResultIndex(self.path)
+        key = cache_key('python', no_html=True)
+        self.index.add(key, {'heading': 'Python', 'entity': 'language'})
+        self.assertEqual(other.search('python'), set())
+        self.assertEqual(other.refresh(), 1)
+        self.assertEqual(other.by_entity('language'), set([key]))
+        self.assertEqual(len(ResultIndex(self.path)), 1)
+
+    def assertRecovers(self, garbage):
+        self.index.add(cache_key('python'), {'heading': 'Python'})
+        with open(self.path, 'ab') as f:
+            f.write(garbage)
+        for i in range(20):
+            self.index.add(cache_key('term', n=i), {'heading': 'Term'})
+        for index in (self.index, ResultIndex(self.path)):
+            self.assertEqual(index.search('python'),
+                             set([cache_key('python')]))
+            self.assertEqual(len(index.search('term')), 20)
+
+    def test_partially_written_record(self):
+        self.assertRecovers(b'\xff\x00\x00\x00{"key"')
+
+    def test_partially_written_record_with_sync_marker(self):
+        self.assertRecovers(b'\xd5\xdbIX\xff\xff\xff\x00\x00\x00\x00\x00{"k')
+
+    def test_checksum_mismatch(self):
+        self.index.add(cache_key('python'), {'heading': 'Python'})
+        with open(self.path, 'r+b') as f:
+            f.seek(-3, os.SEEK_END)
+            f.write(b'XXX')
+        self.index.add(cache_key('monty'), {'heading': 'Monty'})
+        other = ResultIndex(self.path)
+        self.assertEqual(other.search('python'), set())
+        self.assertEqual(other.search('monty'), set([cache_key('monty')]))
+
+    def test_not_index_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not an index file at all')
+        self.assertRaises(exc.DuckDuckDeserializeError,
+                          ResultIndex, self.path)
+
+    def test_compaction(self):
+        index = ResultIndex(self.path, compact_size=4096)
+        other = ResultIndex(self.path)
+        for i in range(200):
+            index.add(cache_key('python'), {'heading': 'Python {0}'.format(i)})
+            self.assertTrue(os.path.getsize(self.path) < 8192)
+        index.add(cache_key('monty'), {'heading': 'Monty'})
+        other.refresh()
+        self.assertEqual(len(other), 2)
+        self.assertEqual(other.search('python 199'),
+                         set([cache_key('python')]))
+        self.assertEqual(other.search('python 198'), set())
+        other.add(cache_key('life'), {'heading': 'Life'})
+        index.refresh()
+        self.assertEqual(index.search('life'), set([cache_key('life')]))
+
+    def test_explicit_compaction(self):
+        for i in range(10):
+            self.index.add(cache_key('python'), {'heading': 'Python'})
+        size = os.path.getsize(self.path)
+        self.index.compact()
+        self.assertTrue(os.path.getsize(self.path) < size)
+        self.assertEqual(len(ResultIndex(self.path)), 1)
+
+    def test_failing_listener(self):
+        cache = ResponseCache()
+        cache.subscribe(mock.Mock(side_effect=ValueError))
+        with mock.patch('duckduckpy.cache.log') as log:
+            cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertTrue(log.exception.called)
+
+    def test_subscribed_to_cache(self):
+        cache = ResponseCache()
+        cache.subscribe(self.index.add)
+        cache.set(cache_key('python'), {'heading': 'Python'})
+        self.assertEqual(self.index.search('python'),
+                         set([cache_key('python')]))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            error_rate=0.5, latency=5, window=4, min_calls=4,
+            reset_timeout=30, max_in_flight=2, name='test_breaker',
+            clock=self.clock)
+
+    def tearDown(self):
+        instrumentation.unregister('test_breaker')
+
+    def failing_call(self):
+        raise exc.DuckDuckConnectionError('down')
+
+    def slow(self):
+        self.clock.now += 6
+        return 'slow'
+
+    def trip(self):
+        for _ in range(2):
+            self.breaker.call(lambda: 'ok')
+        for _ in range(2):
+            self.assertRaises(exc.DuckDuckConnectionError,
+                              self.breaker.call, self.failing_call)
+
+    def test_opens_on_error_rate(self):
+        self.trip()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertRaises(exc.DuckDuckCircuitOpenError,
+                          self.breaker.call, lambda: 'ok')
+
+    def test_stays_closed_below_error_rate(self):
+        for _ in range(3):
+            self.breaker.call(lambda: 'ok')
+        self.assertRaises(exc.DuckDuckConnectionError,
+                          self.breaker.call, self.failing_call)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_opens_on_latency(self):
+        for _ in range(2):
+            self.breaker.call(lambda: 'ok')
+        for _ in range(2):
+            self.assertEqual(self.breaker.call(self.slow), 'slow')
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_argument_error_is_not_counted(self):
+        def wrong():
+            raise exc.DuckDuckArgumentError('wrong')
+        for _ in range(4):
+            self.assertRaises(exc.DuckDuckArgumentError,
+                              self.breaker.call, wrong)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_success_closes(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_failure_opens(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertRaises(exc.DuckDuckConnectionError,
+                          self.breaker.call, self.failing_call)
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_half_open_single_probe(self):
+        self.trip()
+        self.clock.now += 30
+
+        def probe():
+            return self.breaker.call(lambda: 'ok')
+        self.assertRaises(exc.DuckDuckCircuitOpenError,
+                          self.breaker.call, probe)
+
+    def test_load_shedding(self):
+        def nested(depth):
+            if depth:
+                return self.breaker.call(nested, depth - 1)
+        self.assertRaises(exc.DuckDuckOverloadError, nested, 3)
+        self.assertEqual(self.breaker.stats()['in_flight'], 0)
+        self.assertEqual(self.breaker.stats()['shed'], 1)
+
+    @mock.patch('duckduckpy.core.query',
+                side_effect=exc.DuckDuckConnectionError)
+    def test_stale_cache_served_while_open(self, *args):
+        cache = ResponseCache(ttl=10, clock=self.clock)
+        cache.set(cache_key('python'), 'stale')
+        self.clock.now += 10
+        self.trip()
+        self.assertEqual(self.breaker.query('python', cache=cache), 'stale')
+        self.assertRaises(exc.DuckDuckCircuitOpenError,
+                          self.breaker.query, 'other', cache=cache)
+
+    def test_stale_cache_served_while_overloaded(self):
+        cache = ResponseCache(ttl=10, clock=self.clock)
+        cache.set(cache_key('python'), 'stale')
+        self.clock.now += 10
+
+        def overloaded(query_string, **kwargs):
+            return self.breaker.call(
+                self.breaker.call, self.breaker.call, lambda: 'fresh')
+        with mock.patch('duckduckpy.core.query', side_effect=overloaded):
+            self.assertEqual(self.breaker.query('python', cache=cache),
+                             'stale')
+            self.assertRaises(exc.DuckDuckOverloadError,
+                              self.breaker.query, 'other', cache=cache)
+
+    @mock.patch('duckduckpy.core.query', return_value='fresh')
+    def test_query_timeout(self, query_mock):
+        breaker = CircuitBreaker(timeout=3)
+        cache = ResponseCache(clock=self.clock)
+        breaker.query('python', cache=cache)
+        query_mock.assert_called_once_with('python', timeout=3)
+        self.assertEqual(list(cache.keys()), [cache_key('python')])
+        breaker.query('other', timeout=1)
+        query_mock.assert_called_with('other', timeout=1)
+
+    @mock.patch('duckduckpy.core.query', return_value='fresh')
+    def test_query_stores_in_cache(self, query_mock):
+        cache = ResponseCache(clock=self.clock)
+        self.assertEqual(self.breaker.query('python', cache=cache), 'fresh')
+        self.assertEqual(self.breaker.query('python', cache=cache), 'fresh')
+        query_mock.assert_called_once_with('python')
+
+    def test_not_registered_by_default(self):
+        CircuitBreaker()
+        self.assertEqual(list(instrumentation.snapshot()), ['test_breaker'])
+
+    def test_instrumentation(self):
+        self.trip()
+        stats = instrumentation.snapshot()['test_breaker']
+        self.assertEqual(stats['state'], 'open')
+        self.assertEqual(stats['calls'], 4)
+        self.assertEqual(stats['failures'], 2)
+
+
+class TestLazyImport(unittest.TestCase):
+    def imported_modules(self, code):
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        return set(line.split('|')[-1].strip()
+                   for line in decoder(output).splitlines()
+                   if line.startswith('import time:'))
+
+    def test_import_time_benchmark(self):
+        # Module level __getattr__ isn't supported before Python 3.7.
+        if sys.version_info < (3, 7):
+            return
+        imported = (self.imported_modules('import duckduckpy') -
+                    self.imported_modules('pass'))
+        self.assertEqual(imported, set(['duckduckpy']))
+
+    def test_lazy_attributes(self):
+        import duckduckpy
+        import duckduckpy.core
+        self.assertTrue(duckduckpy.query is duckduckpy.core.query)
+        self.assertTrue(duckduckpy.secure_query is
+                        duckduckpy.core.secure_query)
+        self.assertRaises(AttributeError, getattr, duckduckpy, 'missing')
+
+    def test_snake_case_keys(self):
+        keys = (api.ICON_KEYS | api.RESULT_KEYS | api.RELATED_TOPIC_KEYS |
+                api.RESPONSE_KEYS)
+        self.assertEqual(
+            api.SNAKE_CASE_KEYS,
+            dict((key, camel_to_snake_case(key)) for key in keys))
+        for cls, keys in ((api.Icon, api.ICON_KEYS),
+                          (api.Result, api.RESULT_KEYS),
+                          (api.RelatedTopic, api.RELATED_TOPIC_KEYS),
+                          (api.Response, api.RESPONSE_KEYS)):
+            self.assertEqual(set(cls._fields),
+                             set(api.SNAKE_CASE_KEYS[key] for key in keys))
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache.snap')
+        self.clock = FakeClock()
+        self.cache = ResponseCache(ttl=100, clock=self.clock)
+        self.cache.set(cache_key('python'), mocked_query('namedtuple'))
+        self.cache.set(cache_key('python', container='dict'),
+                       mocked_query('dict'))
+        self.cache.set(cache_key('list'), [1, 'x', True, None, 1.5])
+        self.cache.set(cache_key('tuple'), [(1, {'a': (2, 3)})])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_roundtrip(self):
+        self.assertEqual(snapshot.dump(self.cache, self.path), 4)
+        with snapshot.Snapshot(self.path) as snap:
+            self.assertEqual(len(snap), 4)
+            for key, value, expires_at in self.cache.entries():
+                restored = snap.entry(key)
+                self.assertEqual(restored, (value, expires_at))
+                self.assertEqual(type(restored[0]), type(value))
+            response = snap.get(cache_key('python'))
+            self.assertTrue(isinstance(response, api.Response))
+            self.assertTrue(isinstance(response.related_topics[2].topics[0],
+                                       api.Result))
+            self.assertTrue(isinstance(response.related_topics[0].icon,
+                                       api.Icon))
+            self.assertTrue(snap.get(cache_key('missing')) is None)
+
+    def test_lazy_restore(self):
+        snapshot.dump(self.cache, self.path)
+        cache = ResponseCache(clock=self.clock)
+        snap = snapshot.restore(cache, self.path)
+        try:
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.get(cache_key('python')),
+                             self.cache.get(cache_key('python')))
+            self.assertEqual(len(cache), 1)
+            self.assertEqual(cache.expires_at(cache_key('python')), 1100)
+            self.assertTrue(cache.get(cache_key('missing')) is None)
+        finally:
+            snap.close()
+
+    def test_eager_restore(self):
+        snapshot.dump(self.cache, self.path)
+        cache = ResponseCache(clock=self.clock)
+        snapshot.restore(cache, self.path, lazy=False).close()
+        self.assertEqual(sorted(cache.entries()),
+                         sorted(self.cache.entries()))
+
+    def test_dump_after_lazy_restore(self):
+        snapshot.dump(self.cache, self.path)
+        cache = ResponseCache(clock=self.clock)
+        snap = snapshot.restore(cache, self.path)
+        try:
+            cache.get(cache_key('python'))
+            cache.set(cache_key('new'), 'new')
+            self.assertEqual(snapshot.dump(cache, self.path), 5)
+        finally:
+            snap.close()
+        restored = ResponseCache(clock=self.clock)
+        snapshot.restore(restored, self.path, lazy=False).close()
+        self.assertEqual(sorted(restored.entries()),
+                         sorted(self.cache.entries() +
+                                [(cache_key('new'), 'new', 1300)]))
+
+    def test_fallback_keys(self):
+        snapshot.dump(self.cache, self.path)
+        cache = ResponseCache(clock=self.clock)
+        snap = snapshot.restore(cache, self.path)
+        try:
+            self.assertEqual(sorted(cache.keys()), sorted(self.cache.keys()))
+            self.assertEqual(cache.expires_at(cache_key('list')), 1100)
+            self.assertEqual(sorted(cache.entries()),
+                             sorted(self.cache.entries()))
+            refresher = RefreshAhead(cache, lead_time=10, clock=self.clock)
+            refresher.record(cache_key('list'))
+            self.clock.now += 95
+            self.assertEqual(refresher.due(), [cache_key('list')])
+        finally:
+            snap.close()
+
+    def test_other_marshal_version(self):
+        snapshot.dump(self.cache, self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(9)
+            f.write(b'\xff')
+        self.assertRaises(exc.DuckDuckDeserializeError,
+                          snapshot.Snapshot, self.path)
+
+    def test_invalid_file(self):
+        for content in (b'', b'not a snapshot at all, really not'):
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            self.assertRaises(exc.DuckDuckDeserializeError,
+                              snapshot.Snapshot, self.path)
+
+    @benchmark
+    def test_restore_benchmark(self):
+        import timeit
+        keys = [cache_key('python', n=n) for n in range(200)]
+        for key in keys:
+            self.cache.set(key, self.cache.get(cache_key('python')))
+        snapshot.dump(self.cache, self.path)
+
+        def parse():
+            for _ in keys:
+                json.loads(TestQuery.origin, object_hook=Hook('namedtuple'))
+
+        with snapshot.Snapshot(self.path) as snap:
+            restored = min(timeit.repeat(
+                lambda: [snap.get(key) for key in keys], number=1, repeat=3))
+            parsed = min(timeit.repeat(parse, number=1, repeat=3))
+        self.assertTrue(restored < parsed, (restored, parsed))
+
+
+class TestPriorityScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sent = []
+        self.gates = {}
+
+    def query(self, query_string, **kwargs):
+        self.sent.append(query_string)
+        gate = self.gates.get(query_string)
+        if gate is not None:
+            gate.wait(5)
+        return query_string.upper()
+
+    def scheduler(self, workers=1, classes=None, rate=None):
+        scheduler = PriorityScheduler(
+            workers=workers, classes=classes, rate=rate, query=self.query,
+            clock=self.clock)
+        self.addCleanup(scheduler.shutdown)
+        return scheduler
+
+    def block(self, scheduler, query_string, priority='batch'):
+        self.gates[query_string] = threading.Event()
+        ticket = scheduler.submit(query_string, priority=priority)
+        for _ in range(500):
+            if query_string in self.sent:
+                return ticket
+            threading.Event().wait(0.01)
+        self.fail('{0} has not been sent'.format(query_string))
+
+    def test_query(self):
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.query('python', no_html=True), 'PYTHON')
+
+    @mock.patch('duckduckpy.core.query', return_value='response')
+    def test_core_query_by_default(self, query_mock):
+        scheduler = PriorityScheduler(workers=1)
+        self.addCleanup(scheduler.shutdown)
+        self.assertEqual(scheduler.query('python', no_html=True), 'response')
+        query_mock.assert_called_once_with('python', no_html=True)
+
+    def test_unknown_priority(self):
+        self.assertRaises(exc.DuckDuckArgumentError,
+                          self.scheduler().submit, 'python', priority='x')
+
+    def test_weighted_fair_queuing(self):
+        scheduler = self.scheduler(classes={
+            'interactive': PriorityClass(2, None, None),
+            'batch': PriorityClass(1, None, None)})
+        blocker = self.block(scheduler, 'blocker')
+        tickets = [scheduler.submit('b{0}'.format(i), priority='batch')
+                   for i in range(1, 5)]
+        tickets += [scheduler.submit('i{0}'.format(i), priority='interactive')
+                    for i in range(1, 5)]
+        self.gates['blocker'].set()
+        for ticket in [blocker] + tickets:
+            ticket.result(5)
+        self.assertEqual(self.sent[1:],
+                         ['i1', 'b1', 'i2', 'i3', 'b2', 'i4', 'b3', 'b4'])
+
+    def test_class_concurrency(self):
+        scheduler = self.scheduler(workers=2, classes={
+            'interactive': PriorityClass(1, None, None),
+            'batch': PriorityClass(1, 1, None)})
+        self.block(scheduler, 'b1')
+        batch = scheduler.submit('b2', priority='batch')
+        self.assertEqual(scheduler.query('i1'), 'I1')
+        self.assertFalse(batch.done())
+        self.gates['b1'].set()
+        self.assertEqual(batch.result(5), 'B2')
+
+    def test_expired_request_dropped(self):
+        scheduler = self.scheduler()
+        self.block(scheduler, 'blocker')
+        expired = scheduler.submit('expired', deadline=1)
+        alive = scheduler.submit('alive', deadline=10)
+        self.clock.now += 2
+        self.gates['blocker'].set()
+        self.assertEqual(alive.result(5), 'ALIVE')
+        self.assertRaises(exc.DuckDuckDeadlineError, expired.result, 5)
+        self.assertFalse('expired' in self.sent)
+
+    def test_expired_behind_longer_deadline(self):
+        scheduler = self.scheduler()
+        self.block(scheduler, 'blocker')
+        long_ticket = scheduler.submit('long', deadline=10)
+        short_ticket = scheduler.submit('short', deadline=0.05)
+        self.clock.now += 1
+        # Fails while the only worker is still busy.
+        self.assertRaises(exc.DuckDuckDeadlineError, short_ticket.result, 5)
+        self.gates['blocker'].set()
+        self.assertEqual(long_ticket.result(5), 'LONG')
+        self.assertFalse('short' in self.sent)
+
+    def test_idle_scheduler_after_expired_request(self):
+        scheduler = PriorityScheduler(workers=1, query=self.query)
+        self.addCleanup(scheduler.shutdown)
+        self.assertEqual(scheduler.query('i', deadline=0.05), 'I')
+        # Let the worker and the reaper settle after the deadline.
+        threading.Event().wait(0.2)
+        ticket = scheduler.submit('b', priority='batch')
+        self.assertEqual(ticket.result(2), 'B')
+
+    def test_taken_requests_forgotten(self):
+        scheduler = self.scheduler()
+        for i in range(100):
+            scheduler.query('q{0}'.format(i), deadline=100)
+        with scheduler._cond:
+            scheduler._drop_expired()
+            self.assertEqual(scheduler._expiring, {})
+            self.assertEqual(scheduler._expiries, [])
+            self.assertTrue(scheduler._wait_time() is None)
+
+    def test_result_timeout(self):
+        scheduler = self.scheduler()
+        self.block(scheduler, 'blocker')
+        ticket = scheduler.submit('queued')
+        self.assertRaises(exc.DuckDuckTimeoutError, ticket.result, 0.01)
+        self.gates['blocker'].set()
+        self.assertEqual(ticket.result(5), 'QUEUED')
+
+    def test_rate_budget(self):
+        scheduler = self.scheduler(rate=20)
+        tickets = [scheduler.submit('q{0}'.format(i)) for i in range(21)]
+        tickets[19].result(5)
+        threading.Event().wait(0.2)
+        self.assertFalse(tickets[20].done())
+        self.clock.now += 1
+        self.assertEqual(tickets[20].result(5), 'Q20')
+
+    def test_shutdown(self):
+        scheduler = self.scheduler()
+        blocker = self.block(scheduler, 'blocker')
+        queued = scheduler.submit('queued')
+        scheduler.shutdown(wait=False)
+        self.gates['blocker'].set()
+        self.assertEqual(blocker.result(5), 'BLOCKER')
+        self.assertRaises(exc.DuckDuckException, queued.result, 5)
+        self.assertRaises(exc.DuckDuckException, scheduler.submit, 'late')
+
+
+class TestBatchQuery(unittest.TestCase):
+    def test_normalize_term(self):
+        self.assertEqual(normalize_term('  Monty \t Python '), 'monty python')
+
+    @mock.patch('duckduckpy.core.query',
+                side_effect=lambda term, **kwargs: {'term': term})
+    def test_deduplication(self, query_mock):
+        batch = batch_query(
+            ['Python', ' python ', 'Monty', ('PYTHON', {'no_html': True}),
+             ('python', {'no_html': True}), 'Python'], container='dict')
+        self.assertEqual((batch.total, batch.unique, batch.saved), (6, 3, 3))
+        self.assertEqual(query_mock.call_args_list, [
+            mock.call('Python', container='dict'),
+            mock.call('Monty', container='dict'),
+            mock.call('PYTHON', container='dict', no_html=True)])
+        results = batch.results
+        self.assertEqual(results[0], {'term': 'Python'})
+        self.assertTrue(results[0] is results[1] is results[5])
+        self.assertTrue(results[3] is results[4])
+        self.assertEqual(results[2], {'term': 'Monty'})
+
+    def test_failed_term(self):
+        def query(term, **kwargs):
+            if term == 'down':
+                raise exc.DuckDuckConnectionError(term)
+            return term
+
+        batch = batch_query(['a', 'down', 'b', 'DOWN'], query=query)
+        self.assertEqual(batch.results, ['a', None, 'b', None])
+        self.assertEqual(sorted(batch.errors), [1, 3])
+        self.assertTrue(batch.errors[1] is batch.errors[3])
+        self.assertTrue(isinstance(batch.errors[1],
+                                   exc.DuckDuckConnectionError))
+        self.assertEqual((batch.total, batch.unique), (4, 3))
+
+    def test_exact_matches_only(self):
+        batch = batch_query(['Python', 'python', 'Python'], normalize=None,
+                            query=lambda term, **kwargs: term)
+        self.assertEqual(batch.results, ['Python', 'python', 'Python'])
+        self.assertEqual(batch.unique, 2)
+
+    def test_copy_dict(self):
+        def query(term, **kwargs):
+            return {'term': term}
+        batch = batch_query(['a', 'A'], copy=True, container='dict',
+                            query=query)
+        self.assertEqual(batch.results[0], batch.results[1])
+        self.assertFalse(batch.results[0] is batch.results[1])
+
+    def test_namedtuple_shared(self):
+        def query(term, **kwargs):
+            return api.Icon('url', 1, 2)
+        batch = batch_query(['a', 'A'], copy=True, query=query)
+        self.assertTrue(batch.results[0] is batch.results[1])
+
 
 if __name__ == '__main__':
     unittest.main()